@@ -2,30 +2,194 @@ import cv2
 import time
 from datetime import datetime
 import subprocess
+import shutil
+import signal
+import psutil
 import webbrowser
 import os
-import json
 import sys
+import queue
+import threading
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 from src.database import ANPRDatabase
+from src.capture import open_capture
 from src.detector import VehicleDetector
 from src.ocr import OCRSystem
+from src.overlay import draw_cached_text
 
-def main():
-    print("[Starting] Location Service...")
-    
-    # 0. Kill stale Node.js processes (Windows specific, simplifies re-runs)
+class GpsStateHandler(FileSystemEventHandler):
+    """Sets an Event when the watched GPS state file is written."""
+    def __init__(self, path, updated):
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self.updated = updated
+
+    def on_any_event(self, event):
+        # Writers may modify in place or replace via rename, so check both paths
+        for p in (event.src_path, getattr(event, 'dest_path', '')):
+            if p and os.path.abspath(p) == self.path:
+                self.updated.set()
+
+def wait_for_file_update(path, initial_mtime):
+    """Block until path's mtime moves past initial_mtime, woken by filesystem events instead of polling."""
+    updated = threading.Event()
+    watch_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(watch_dir, exist_ok=True)
+
+    observer = Observer()
+    observer.schedule(GpsStateHandler(path, updated), watch_dir, recursive=False)
+    observer.start()
+    try:
+        while True:
+            # Checked before waiting too, in case the write landed before the observer started
+            if os.path.exists(path) and os.path.getmtime(path) > initial_mtime:
+                return
+            # Timeout only keeps Ctrl+C responsive (Windows) and covers filesystems that drop events
+            updated.wait(timeout=1)
+            updated.clear()
+    finally:
+        observer.stop()
+        observer.join()
+
+def box_iou(a, b):
+    """Intersection-over-union of two (x1, y1, x2, y2) boxes."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+def gray_roi(gray, x1, y1, x2, y2):
+    """Crop a grayscale image (ndarray or cv2.UMat) without copying pixels."""
+    if isinstance(gray, cv2.UMat):
+        return cv2.UMat(gray, (y1, y2), (x1, x2))
+    return gray[y1:y2, x1:x2]
+
+LOCATION_SERVER_PID_PATH = os.path.join("data", "location_server.pid")
+
+# <Detected Plate>, <Owner Name>, <Vehicle Name>, <Latitude>, <Longitude>, <Timestamp>
+ENTRY_OUTPUT_FORMAT = "%s, %s, %s, %s, %s, %s"
+
+logger = logging.getLogger('anpr')
+
+def start_log_listener():
+    """
+    Route the 'anpr' logger through a queue so console I/O happens on a background
+    thread instead of the OCR stage. Returns the started QueueListener.
+    """
+    log_queue = queue.Queue(-1)
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter('%(message)s'))
+
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    listener = QueueListener(log_queue, console)
+    listener.start()
+    return listener
+
+def is_our_location_server(proc, pid_file_mtime):
+    """
+    True if proc is the `node location_server.js` that wrote the PID file.
+    The PID file is written right after the server is spawned, so a process started
+    after it (or long before it) holds a reused PID and belongs to someone else.
+    """
+    try:
+        cmdline = proc.cmdline()
+        started = proc.create_time()
+    except psutil.Error:
+        return False
+    if not cmdline:
+        return False
+    exe = os.path.basename(cmdline[0]).lower()
+    if exe not in ("node", "node.exe"):
+        return False
+    if not any(os.path.basename(arg) == "location_server.js" for arg in cmdline[1:]):
+        return False
+    return pid_file_mtime - 10 <= started <= pid_file_mtime + 1
+
+def stop_stale_location_server():
+    """Terminate the location server recorded in the PID file by a previous run, if still alive."""
+    try:
+        with open(LOCATION_SERVER_PID_PATH, 'r') as f:
+            pid = int(f.read().strip())
+        pid_file_mtime = os.path.getmtime(LOCATION_SERVER_PID_PATH)
+    except (OSError, ValueError):
+        return
+
+    try:
+        proc = psutil.Process(pid)
+        if is_our_location_server(proc, pid_file_mtime):
+            proc.terminate() # TerminateProcess on Windows
+            print(f"[Info] Stopped stale location server (PID {pid}).")
+        else:
+            # PID reused after a crash/reboot - not ours, leave it alone
+            print(f"[Info] PID {pid} from {LOCATION_SERVER_PID_PATH} is not our location server; not stopping it.")
+    except psutil.Error:
+        pass # Already gone
     try:
-        subprocess.run(["taskkill", "/F", "/IM", "node.exe"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except:
+        os.remove(LOCATION_SERVER_PID_PATH)
+    except OSError:
         pass
 
-    # 1. Start Node.js Server
-    # Using shell=True for windows to find node in path easily, or full path if needed.
-    # We assume 'node' is in PATH.
+def start_location_server():
+    """Launch location_server.js directly (no shell) and record its PID. Returns the Popen or None."""
+    node = shutil.which("node")
+    if node is None:
+        print("[Error] Failed to start Node.js server: 'node' not found in PATH.")
+        return None
+
+    kwargs = {}
+    if os.name == 'nt':
+        # Own process group so it can be asked to exit with CTRL_BREAK_EVENT
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
     try:
-        node_process = subprocess.Popen(["node", "location_server.js"], cwd=os.getcwd(), shell=True)
+        node_process = subprocess.Popen([node, "location_server.js"], cwd=os.getcwd(), **kwargs)
     except Exception as e:
         print(f"[Error] Failed to start Node.js server: {e}")
+        return None
+
+    try:
+        os.makedirs(os.path.dirname(LOCATION_SERVER_PID_PATH), exist_ok=True)
+        with open(LOCATION_SERVER_PID_PATH, 'w') as f:
+            f.write(str(node_process.pid))
+    except OSError as e:
+        print(f"[Warning] Could not write {LOCATION_SERVER_PID_PATH}: {e}")
+    return node_process
+
+def stop_location_server(node_process):
+    """Ask the location server to exit, kill it if it doesn't, and clear the PID file."""
+    try:
+        if os.name == 'nt':
+            node_process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            node_process.terminate()
+        node_process.wait(timeout=3)
+    except Exception:
+        node_process.kill()
+    try:
+        os.remove(LOCATION_SERVER_PID_PATH)
+    except OSError:
+        pass
+
+def main():
+    print("[Starting] Location Service...")
+    
+    # 0. Stop a location server left over from a previous run (tracked by PID file,
+    #    so other Node.js apps on the machine are left alone)
+    stop_stale_location_server()
+
+    # 1. Start Node.js Server
+    node_process = start_location_server()
+    if node_process is None:
         return
 
     # 2. Open Browser
@@ -48,20 +212,12 @@ def main():
     if os.path.exists(gps_state_path):
         initial_mtime = os.path.getmtime(gps_state_path)
         
-    waiting = True
-    while waiting:
-        if os.path.exists(gps_state_path):
-            current_mtime = os.path.getmtime(gps_state_path)
-            if current_mtime > initial_mtime:
-                # File updated!
-                print("[Ready] Location signal received. Starting ANPR...")
-                waiting = False
-            else:
-                time.sleep(1)
-        else:
-            time.sleep(1)
+    wait_for_file_update(gps_state_path, initial_mtime)
+    # File updated!
+    print("[Ready] Location signal received. Starting ANPR...")
 
     print("[Starting] ANPR System Initializing...")
+    log_listener = start_log_listener()
     
     # Initialize components
     db = ANPRDatabase()
@@ -69,177 +225,360 @@ def main():
     ocr = OCRSystem()
     
     # Add dummy authorized vehicles for testing
-    db.add_authorized_vehicle("KA01AB1234", "Admin User")
-    db.add_authorized_vehicle("KA01AB5678", "other user")
+    db.add_authorized_vehicles([
+        ("KA01AB1234", "Admin User"),
+        ("KA01AB5678", "other user"),
+    ])
 
 
     
-    # Open Camera (0 for webcam, or RTSP url)
-    # Using cv2.CAP_DSHOW on Windows can sometimes fix initialization issues
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    # Open Camera (0 for webcam, or RTSP url / video file path)
+    # Streams are decoded on the GPU (NVDEC) when OpenCV has CUDA support
+    camera_source = 0
+    cap = open_capture(camera_source, 1280, 720)
     
     if not cap.isOpened():
         print("[Error] Could not open camera. Please check your webcam connection.")
+        log_listener.stop()
         # Kill node before exit
-        node_process.terminate()
+        stop_location_server(node_process)
         return
 
     print("[Ready] Press 'q' to exit. Starting main loop...")
     
     # Config
-    frame_count = 0
-    process_every_n_frames = 5 # Skip frames for performance
+    process_every_n_frames = 5 # Run YOLO on every Nth frame; frames in between reuse the last boxes
+    detect_batch_size = 4 # Max key frames per YOLO forward pass when detection falls behind capture
+    max_concurrent_ocr = 2 # Plates OCR'd in parallel per frame
+    directory_refresh_every = 30 # Frames between vehicles.db.json mtime checks
+    ocr_refresh_iou = 0.6 # Re-OCR a vehicle once its box moves below this IoU vs. the last read...
+    ocr_refresh_secs = 1.0 # ...or once the last read is older than this
+    window_poll_every = 30 # Displayed frames between window 'X'-close checks
+    # Grayscale + plate search on the (i)GPU via cv2.UMat when OpenCL is available and enabled;
+    # OpenCV's process-wide OpenCL setting is left as is
+    use_opencl = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
     last_log_time = {} # plate -> time
     LOG_COOLDOWN = 10 # seconds
 
-    try:
-        while True:
-            # Debug: Print a dot every 60 frames to show life, or on first frame
-            if frame_count == 0:
-                print("[Debug] Attempting to read first frame...")
+    # Pipeline: capture -> detect -> OCR run on their own threads so the camera decode,
+    # YOLO inference and plate OCR overlap on consecutive frames instead of running back to back.
+    # Queues are kept tiny so a slow stage applies backpressure instead of piling up stale frames.
+    # Room for detect_batch_size key frames plus the frames between them, so a backlog can
+    # actually put more than one key frame into a single forward pass
+    cap_q = queue.Queue(maxsize=detect_batch_size * process_every_n_frames)   # (frame_id, frame)
+    det_q = queue.Queue(maxsize=2)   # (frame_id, frame, vehicles)
+    disp_q = queue.Queue(maxsize=1)  # (frame_id, display_frame)
+    stop_event = threading.Event()
+    ocr_memory = [] # (vehicle_box, (text, conf), read_time) from the previous processed frame
+
+    # OCR of the plates within one frame is independent, so fan it out to a small pool
+    ocr_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="anpr-ocr-worker")
+    ocr_slots = threading.Semaphore(max_concurrent_ocr)
+    ocr_bufs = threading.local()
+
+    def put_latest(q, item):
+        """Push item, dropping the oldest queued item if the consumer is behind."""
+        while not stop_event.is_set():
+            try:
+                q.put(item, block=True, timeout=0.05)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
 
-            ret, frame = cap.read()
+    def get_next(q):
+        """Pop the next item, returning None once the pipeline is stopping."""
+        while not stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def capture_stage():
+        # Thread A: only reads frames from the camera
+        frame_id = 0
+        print("[Debug] Attempting to read first frame...")
+        while not stop_event.is_set():
+            # Downstream is behind: throw away the buffered frame so we retrieve a fresh one.
+            # (Not all backends honour CAP_PROP_BUFFERSIZE.)
+            if cap_q.full():
+                cap.grab()
+
+            ret = cap.grab()
+            frame = None
+            if ret:
+                ret, frame = cap.retrieve()
             if not ret:
                 print("[Error] Failed to grab frame. Camera stream ended or disconnected.")
+                stop_event.set()
                 break
-                
-            if frame_count == 0:
+
+            if frame_id == 0:
                 print("[Debug] First frame read successfully. Dimensions:", frame.shape)
 
-            frame_count += 1
-            display_frame = frame.copy()
-            
-            # Only process every Nth frame to save CPU/GPU if needed
-            # But we want smooth tracking, so maybe just OCR less often? 
-            # For simplicity in this logical loop, we run detection every frame but OCR only on good detections.
-            
-            # Performance check: only run detection logic if frame read is fine
+            frame_id += 1
+            put_latest(cap_q, (frame_id, frame))
+
+    def detect_stage():
+        # Thread B: YOLO vehicle detection on every Nth frame; the frames in between carry
+        # the last detections forward. Whatever key frames queued up while the previous
+        # pass was running are detected together in one batched forward pass.
+        seen = 0
+        last_vehicles = detector.no_detections()
+        while not stop_event.is_set():
+            item = get_next(cap_q)
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < cap_q.maxsize:
+                try:
+                    batch.append(cap_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            due = []
+            for i in range(len(batch)):
+                if seen % process_every_n_frames == 0:
+                    due.append(i)
+                seen += 1
+
+            detected = {}
+            if due:
+                # Only key frames are shrunk to YOLO's input size (INTER_AREA) before inference;
+                # boxes come back in full-frame coordinates.
+                small_frames = [detector.downscale(batch[i][1]) for i in due]
+                orig_shapes = [batch[i][1].shape for i in due]
+                try:
+                    batch_vehicles = detector.detect_vehicles_batch(small_frames, orig_shapes)
+                except Exception as e:
+                    print(f"[Error] Detection failed: {e}")
+                    batch_vehicles = [detector.no_detections() for _ in due]
+                detected = dict(zip(due, batch_vehicles))
+
+            for i, (frame_id, frame) in enumerate(batch):
+                if i in detected:
+                    last_vehicles = detected[i]
+                put_latest(det_q, (frame_id, frame, last_vehicles))
+
+    def ocr_stage():
+        # Thread C: plate localisation, OCR, authorization and logging. Also draws the overlay.
+        processed = 0
+        while not stop_event.is_set():
+            item = get_next(det_q)
+            if item is None:
+                break
+            frame_id, frame, vehicles = item
+
+            processed += 1
+            if processed % directory_refresh_every == 0:
+                db.refresh_vehicles()
+
+            # The overlay is drawn straight onto the frame (after all crops are consumed),
+            # so no per-frame display copy is needed.
             try:
-                vehicles = detector.detect_vehicles(frame)
+                process_vehicles(frame, vehicles)
             except Exception as e:
-                print(f"[Error] Detection failed: {e}")
-                vehicles = []
+                print(f"[Error] Plate processing failed: {e}")
+
+            put_latest(disp_q, (frame_id, frame))
+
+    def process_vehicles(frame, vehicles):
+        # Pass 1: localise plates. Nothing is drawn yet - plate crops are views into frame.
+        no_plate_boxes = []
+        plate_boxes = []
+        plates = [] # (plate_img, (abs_px1, abs_py1, abs_px2, abs_py2), vehicle_box)
+        boxes, _, _ = vehicles
+        # Boxes arrive as an (N,4) int32 array; tolist() yields plain ints in one C call
+        vehicle_boxes = boxes.tolist()
+
+        # Grayscale once per frame - only the region covering all vehicles - and slice per vehicle.
+        # The same gray pixels feed both the Haar plate search and OCR.
+        if vehicle_boxes:
+            gx1, gy1 = int(boxes[:, 0].min()), int(boxes[:, 1].min())
+            gx2, gy2 = int(boxes[:, 2].max()), int(boxes[:, 3].max())
+            # With OpenCL the region is uploaded once and stays on the device; only plate crops come back
+            region = frame[gy1:gy2, gx1:gx2]
+            gray = cv2.cvtColor(cv2.UMat(region) if use_opencl else region, cv2.COLOR_BGR2GRAY)
+
+        for (x1, y1, x2, y2) in vehicle_boxes:
+            # Crop Vehicle
+            vehicle_img = frame[y1:y2, x1:x2]
+            vehicle_gray = gray_roi(gray, x1 - gx1, y1 - gy1, x2 - gx1, y2 - gy1)
             
-            for (v_box, v_conf, v_cls) in vehicles:
-                x1, y1, x2, y2 = map(int, v_box)
-                
-                # Draw Vehicle Box
-                cv2.rectangle(display_frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
-                cv2.putText(display_frame, "Vehicle", (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-                
-                # Crop Vehicle
-                vehicle_img = frame[y1:y2, x1:x2]
-                
-                # Detect Plate within Vehicle
-                plate_img, p_box = detector.detect_plate(vehicle_img)
+            # Detect Plate within Vehicle
+            plate_img, p_box = detector.detect_plate(vehicle_img, vehicle_gray)
+            
+            if plate_img is not None and p_box is not None:
+                px1, py1, px2, py2 = p_box
+                # Plate Box (relative to frame)
+                abs_box = (x1 + px1, y1 + py1, x1 + px2, y1 + py2)
+                plate_boxes.append(abs_box)
                 
-                if plate_img is not None and p_box is not None:
-                    px1, py1, px2, py2 = p_box
-                    # Draw Plate Box (relative to frame)
-                    abs_px1 = x1 + px1
-                    abs_py1 = y1 + py1
-                    abs_px2 = x1 + px2
-                    abs_py2 = y1 + py2
-                    
-                    cv2.rectangle(display_frame, (abs_px1, abs_py1), (abs_px2, abs_py2), (0, 255, 0), 2)
-                    
-                    # Run OCR
-                    # Only run OCR if plate resolution is decent
-                    # Lowered thresholds for testing
-                    if plate_img.shape[0] > 10 and plate_img.shape[1] > 30:
-                        text, conf = ocr.extract_text(plate_img)
-                        
-                        # Lowered thresholds for testing
-                        if text and conf > 0.3: # Lower confidence slightly
-                            # Debug: Print what we see
-                            # print(f"[OCR] Detected: '{text}' (Conf: {conf:.2f})")
-                            
-                            color = (0, 0, 255) # Red for unauthorized
-                            status = "Access Denied"
-                            
-                            is_auth, owner = db.is_authorized(text)
-                            
-                            if is_auth:
-                                color = (0, 255, 0) # Green for authorized
-                                status = f"Access Granted ({owner})"
-                                # print(f"[Success] Authorized vehicle verified: {text}")
-                                
-                                # Log to DB with cooldown
-                                current_time = time.time()
-                                if text not in last_log_time or (current_time - last_log_time[text] > LOG_COOLDOWN):
-                                    db.log_entry(text, location="Main Gate", confidence=conf)
-                                    last_log_time[text] = current_time
-                                    
-                                    # Output Format Requirement:
-                                    # <Detected Plate>, <Owner Name>, <Vehicle Name>, <Latitude>, <Longitude>, <Timestamp>
-                                    
-                                    # Fetch current location state directly
-                                    lat = ""
-                                    long = ""
-                                    try:
-                                        with open(gps_state_path, 'r') as f:
-                                            st = json.load(f)
-                                            lat = st.get("lat", "")
-                                            long = st.get("long", "")
-                                    except:
-                                        pass
-                                    
-                                    # Vehicle Name Lookup
-                                    veh_name = "Unknown Vehicle"
-                                    vehicles_db_path = os.path.join("data", "vehicles.db.json")
-                                    if os.path.exists(vehicles_db_path):
-                                        try:
-                                            with open(vehicles_db_path, 'r') as vf:
-                                                v_data = json.load(vf)
-                                                # Find vehicle by plate
-                                                # v_data is a list of objects
-                                                for v_obj in v_data:
-                                                    if v_obj.get("numberPlate") == text:
-                                                        veh_name = v_obj.get("vehicleName", "Unknown Vehicle") or "Unknown Vehicle"
-                                                        break
-                                        except:
-                                            pass
-                                    
-                                    # Construct Timestamp
-                                    ts_str = datetime.now().isoformat()
-                                    
-                                    # Print SPECIAL OUTPUT
-                                    print(f"{text}, {owner}, {veh_name}, {lat}, {long}, {ts_str}")
-
-                            # else:
-                                 # print(f"[Info] Vehicle '{text}' is NOT authorized.")
-
-                            # Display Text
-                            cv2.putText(display_frame, f"{text} [{conf:.2f}]", (abs_px1, abs_py1 - 10), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-                            cv2.putText(display_frame, status, (abs_px1, abs_py2 + 25), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-                else:
-                    # Debug: Draw yellow box if vehicle found but NO plate found
-                    cv2.rectangle(display_frame, (x1, y1), (x2, y2), (0, 255, 255), 2)
-                    cv2.putText(display_frame, "No Plate", (x1, y1+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+                # Only run OCR if plate resolution is decent
+                # Lowered thresholds for testing
+                if plate_img.shape[0] > 10 and plate_img.shape[1] > 30:
+                    # OCR reads the gray crop directly (no second color conversion)
+                    plate_gray = gray_roi(vehicle_gray, px1, py1, px2, py2)
+                    if isinstance(plate_gray, cv2.UMat):
+                        plate_gray = plate_gray.get()
+                    plates.append((plate_gray, abs_box, (x1, y1, x2, y2)))
+            else:
+                no_plate_boxes.append((x1, y1, x2, y2))
+
+        # Pass 2: OCR every plate in the frame concurrently, then handle results in order.
+        # A vehicle that barely moved since its last read (IoU >= ocr_refresh_iou, read less than
+        # ocr_refresh_secs ago) reuses that read instead of running OCR again.
+        now = time.time()
+        pending = [] # (reused (result, read_time) or None, future or None)
+        for (plate_img, _, v_box) in plates:
+            reused = recall_ocr(v_box, now)
+            future = ocr_pool.submit(run_ocr, plate_img) if reused is None else None
+            pending.append((reused, future))
+
+        labels = [] # (text, conf, color, status, plate_box)
+        fresh_memory = []
+        for (_, plate_box, v_box), (reused, future) in zip(plates, pending):
+            if reused is not None:
+                (text, conf), read_time = reused
+            else:
+                (text, conf), read_time = future.result(), now
+            fresh_memory.append((v_box, (text, conf), read_time))
+
+            label = handle_plate(text, conf)
+            if label is not None:
+                labels.append(label + (plate_box,))
+
+        ocr_memory[:] = fresh_memory
+
+        # Pass 3: draw the overlay onto the frame itself
+        for (x1, y1, x2, y2) in vehicle_boxes:
+            # Draw Vehicle Box
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2)
+            draw_cached_text(frame, "Vehicle", (x1, y1-10), 0.5, (255, 0, 0), 2)
+
+        for (x1, y1, x2, y2) in no_plate_boxes:
+            # Debug: Draw yellow box if vehicle found but NO plate found
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 255), 2)
+            draw_cached_text(frame, "No Plate", (x1, y1+20), 0.5, (0, 255, 255), 1)
+
+        for (abs_px1, abs_py1, abs_px2, abs_py2) in plate_boxes:
+            cv2.rectangle(frame, (abs_px1, abs_py1), (abs_px2, abs_py2), (0, 255, 0), 2)
+
+        for (text, conf, color, status, (abs_px1, abs_py1, abs_px2, abs_py2)) in labels:
+            # Display Text (plate text changes every read; status labels repeat, so they're cached)
+            cv2.putText(frame, f"{text} [{conf:.2f}]", (abs_px1, abs_py1 - 10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+            draw_cached_text(frame, status, (abs_px1, abs_py2 + 25), 0.7, color, 2)
+
+    def recall_ocr(v_box, now):
+        # Returns ((text, conf), read_time) of a recent read of the same vehicle, or None
+        for (prev_box, result, read_time) in ocr_memory:
+            if now - read_time < ocr_refresh_secs and box_iou(v_box, prev_box) >= ocr_refresh_iou:
+                return result, read_time
+        return None
+
+    def run_ocr(plate_img):
+        # Each pool worker keeps its own preprocessing scratch buffer
+        buf = getattr(ocr_bufs, 'buf', None)
+        if buf is None:
+            buf = ocr_bufs.buf = ocr.new_buffer()
+        # Semaphore caps in-flight OCR calls so a GPU-bound reader isn't thrashed
+        with ocr_slots:
+            return ocr.extract_text(plate_img, out=buf)
+
+    def handle_plate(text, conf):
+        # Authorization + logging for one OCR result. Returns (text, conf, color, status) to draw, or None.
+        # Lowered thresholds for testing
+        if text and conf > 0.3: # Lower confidence slightly
+            # Debug: Print what we see
+            # print(f"[OCR] Detected: '{text}' (Conf: {conf:.2f})")
+
+            color = (0, 0, 255) # Red for unauthorized
+            status = "Access Denied"
+
+            is_auth, owner = db.is_authorized(text)
+
+            if is_auth:
+                color = (0, 255, 0) # Green for authorized
+                status = f"Access Granted ({owner})"
+                # print(f"[Success] Authorized vehicle verified: {text}")
+
+                # Log to DB with cooldown
+                current_time = time.time()
+                if text not in last_log_time or (current_time - last_log_time[text] > LOG_COOLDOWN):
+                    db.log_entry(text, location="Main Gate", confidence=conf, owner_name=owner)
+                    last_log_time[text] = current_time
+
+                    # Output Format Requirement:
+                    # <Detected Plate>, <Owner Name>, <Vehicle Name>, <Latitude>, <Longitude>, <Timestamp>
+
+                    # Current location state (cached by the DB, re-read only when the file changes)
+                    lat, long = db.current_location()
+
+                    # Vehicle Name Lookup (cached, refreshed periodically by the OCR stage)
+                    veh_name = "Unknown Vehicle"
+                    v_obj = db.vehicle_record(text)
+                    if v_obj:
+                        veh_name = v_obj.get("vehicleName", "Unknown Vehicle") or "Unknown Vehicle"
+
+                    # Construct Timestamp
+                    ts_str = datetime.now().isoformat(timespec='seconds')
+
+                    # Print SPECIAL OUTPUT (written to stdout by the log listener thread)
+                    logger.info(ENTRY_OUTPUT_FORMAT, text, owner, veh_name, lat, long, ts_str)
+
+            # else:
+                 # print(f"[Info] Vehicle '{text}' is NOT authorized.")
+
+            return text, conf, color, status
+        return None
+
+    ocr_thread = threading.Thread(target=ocr_stage, name="anpr-ocr", daemon=True)
+    workers = [
+        threading.Thread(target=capture_stage, name="anpr-capture", daemon=True),
+        threading.Thread(target=detect_stage, name="anpr-detect", daemon=True),
+        ocr_thread,
+    ]
+    for t in workers:
+        t.start()
+
+    # Main thread: display only. HighGUI must stay on the main thread (macOS/Windows requirement).
+    frame_count = 0
+    try:
+        while not stop_event.is_set():
+            try:
+                frame_id, display_frame = disp_q.get(timeout=0.1)
+            except queue.Empty:
+                # Keep the window responsive while the pipeline warms up
+                if frame_count > 0 and cv2.waitKey(1) & 0xFF == ord('q'):
+                    print("[Info] User requested exit.")
+                    break
+                continue
+
+            frame_count += 1
 
             # Show Output
             cv2.imshow('ANPR System', display_frame)
             
-            # Force focus on start (first few frames)
-            if frame_count < 10:
+            # Force focus on start (once, right after the window is created)
+            if frame_count == 1:
                  try:
                      cv2.setWindowProperty('ANPR System', cv2.WND_PROP_TOPMOST, 1)
-                     # cv2.setWindowProperty('ANPR System', cv2.WND_PROP_TOPMOST, 0) # Immediately disable always-on-top so user can alt-tab?
-                     # Let's just set it once. 
                  except:
                      pass
 
-            # Enable 'X' button close
-            try:
-                if cv2.getWindowProperty('ANPR System', cv2.WND_PROP_VISIBLE) < 1:
-                    print("[Info] User closed window.")
-                    break
-            except:
-                pass
+            # Enable 'X' button close. Polled every N frames: on some backends this is a
+            # synchronous round-trip to the window system.
+            if frame_count % window_poll_every == 0:
+                try:
+                    if cv2.getWindowProperty('ANPR System', cv2.WND_PROP_VISIBLE) < 1:
+                        print("[Info] User closed window.")
+                        break
+                except:
+                    pass
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 print("[Info] User requested exit.")
@@ -247,12 +586,21 @@ def main():
     except KeyboardInterrupt:
         print("[Info] Interrupted.")
     finally:
+        stop_event.set()
+        # Capture/detect only feed queues; don't hang on a stuck camera read
+        for t in workers:
+            if t is not ocr_thread:
+                t.join(timeout=2)
+        # The OCR stage writes to the DB and the log listener: let it finish its current frame
+        # (including in-flight OCR reads) before either is closed, so no entry is lost
+        ocr_thread.join()
+        ocr_pool.shutdown(wait=True)
         cap.release()
         cv2.destroyAllWindows()
         db.close()
+        log_listener.stop() # Flushes pending entry lines
         # Kill node
-        # subprocess.Popen("taskkill /F /T /PID " + str(node_process.pid), shell=True) # Windows specific
-        node_process.kill()
+        stop_location_server(node_process)
 
 if __name__ == "__main__":
     main()
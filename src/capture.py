@@ -0,0 +1,77 @@
+import cv2
+
+def cuda_decode_available():
+    """True if this OpenCV build has cudacodec and a CUDA device is present."""
+    try:
+        return hasattr(cv2, 'cudacodec') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+class CudaVideoCapture:
+    """
+    Minimal cv2.VideoCapture look-alike that decodes on the GPU (NVDEC) via cv2.cudacodec.
+    Only works for files / network streams (RTSP, HTTP), not local webcam indices.
+    """
+    def __init__(self, source):
+        self.reader = cv2.cudacodec.createVideoReader(source)
+        try:
+            # OpenCV >= 4.7 can convert to BGR on the device
+            self.reader.set(cv2.cudacodec.ColorFormat_BGR)
+        except (AttributeError, cv2.error):
+            pass
+        self._gpu_frame = None
+
+    def isOpened(self):
+        return self.reader is not None
+
+    def set(self, prop, value):
+        # Resolution and buffering are fixed by the stream itself
+        return False
+
+    def grab(self):
+        ok, gpu_frame = self.reader.nextFrame()
+        self._gpu_frame = gpu_frame if ok else None
+        return ok
+
+    def retrieve(self):
+        """Download the last grabbed frame as a BGR numpy array."""
+        if self._gpu_frame is None:
+            return False, None
+        frame = self._gpu_frame.download()
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+        return True, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        self.reader = None
+        self._gpu_frame = None
+
+def open_capture(source=0, width=1280, height=720):
+    """
+    Open a camera (int index) or stream/file (str).
+    Streams are decoded on the GPU when OpenCV was built with CUDA + cudacodec,
+    otherwise the regular CPU VideoCapture is used.
+    """
+    if isinstance(source, str) and cuda_decode_available():
+        try:
+            cap = CudaVideoCapture(source)
+            print("[Camera] Decoding stream on GPU (NVDEC).")
+            return cap
+        except cv2.error as e:
+            print(f"[Warning] GPU decode unavailable for this stream ({e}). Falling back to CPU.")
+
+    if isinstance(source, int):
+        # Using cv2.CAP_DSHOW on Windows can sometimes fix initialization issues
+        cap = cv2.VideoCapture(source, cv2.CAP_DSHOW)
+    else:
+        cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    # Keep only the freshest frame in the driver so a stalled stage never gets an old one
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
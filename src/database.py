@@ -1,23 +1,113 @@
 import sqlite3
 import os
 import json
+import threading
+import functools
+import time
 from datetime import datetime
 
+try:
+    import orjson # Optional: faster serialisation for the JSONL append path
+except ImportError:
+    orjson = None
+
+# Characters dropped from plate strings before lookup/storage
+_STRIP = str.maketrans('', '', ' \t\r\n-')
+
+@functools.lru_cache(maxsize=128)
+def normalize_plate(plate_number):
+    """Canonical plate form: whitespace and hyphens removed, uppercase. Memoized for repeat reads."""
+    return plate_number.translate(_STRIP).upper()
+
+def _json_line(obj):
+    """Serialise obj as one JSONL line (bytes)."""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj) + "\n").encode('utf-8')
+
+def _json_loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
 class ANPRDatabase:
-    def __init__(self, db_path='data/anpr.db'):
+    _INSERT_ACCESS_SQL = '''
+        INSERT INTO access_logs (plate_number, timestamp, location, confidence, image_path)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    _INSERT_DETECTION_SQL = '''
+        INSERT INTO all_detections (plate_number, timestamp, confidence, is_authorized)
+        VALUES (?, ?, ?, ?)
+    '''
+    # Native UPSERT (SQLite 3.24+): a duplicate plate is a no-op with rowcount 0, not an exception
+    _INSERT_AUTHORIZED_SQL = '''
+        INSERT INTO authorized_vehicles (plate_number, owner_name) VALUES (?, ?)
+        ON CONFLICT(plate_number) DO NOTHING
+    '''
+
+    def __init__(self, db_path='data/anpr.db', flush_interval=0.2, compact_interval=60):
         """Initialize the database connection and create tables if they don't exist."""
         # Ensure the directory exists
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        # isolation_level=None: autocommit; multi-statement paths use explicit BEGIN/COMMIT.
+        # No shared cursor: every statement goes through conn.execute(), which returns a fresh
+        # cursor, so threads never race on one cursor's bound parameters / rowcount.
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._configure_connection()
         self._create_tables()
+        self._load_authorized()
+
+        # Connection is shared with the background flusher; serialize statements on it
+        self._write_lock = threading.Lock()
+
+        # Human-readable log (vehicles.db.json) is kept in memory as plate -> entry. Each new
+        # location is appended to vehicles.db.jsonl right away; the pretty .json is rewritten
+        # from memory every compact_interval seconds and on close().
+        self.json_path = os.path.join(os.path.dirname(db_path), 'vehicles.db.json')
+        self.jsonl_path = self.json_path + 'l'
+        self.compact_interval = compact_interval
+        self._json_lock = threading.Lock()
+        self._load_vehicle_index()
+
+        # Parsed gps_state.json, refreshed only when the file's mtime changes
+        self._gps_state_path = os.path.join(os.path.dirname(db_path), 'gps_state.json')
+        self._gps_cache = {"mtime": 0, "lat": "", "long": ""}
+
+        # access_logs / all_detections rows are buffered and written in one transaction every
+        # flush_interval seconds by a daemon thread, instead of one INSERT + commit per row
+        self.flush_interval = flush_interval
+        self._pending_access = []
+        self._pending_detections = []
+        self._pending_lock = threading.Lock()
+        self._dirty = False # set by hot-path writers, cleared by flush()
+        self._stop_flush = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="anpr-db-flush", daemon=True)
+        self._flusher.start()
+
+    def _configure_connection(self):
+        """Tune SQLite for a single-writer logging workload."""
+        # WAL avoids the fsync-heavy rollback journal; NORMAL only syncs at checkpoints,
+        # which is still crash-safe in WAL mode.
+        try:
+            mode = self.conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if mode.lower() != 'wal':
+                print(f"[DB] WAL not supported here, using journal_mode={mode}.")
+        except sqlite3.DatabaseError as e:
+            # e.g. network filesystems without shared-memory support
+            print(f"[DB] Could not enable WAL: {e}")
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-64000')  # ~64 MB page cache
+        self.conn.execute('PRAGMA busy_timeout=5000')  # wait on a locked DB instead of failing
+        self.conn.commit()
 
     def _create_tables(self):
         """Create necessary tables for the system."""
+        self.conn.execute('BEGIN')
         # Table for authorized vehicles
-        self.cursor.execute('''
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS authorized_vehicles (
                 plate_number TEXT PRIMARY KEY,
                 owner_name TEXT,
@@ -26,7 +116,7 @@ class ANPRDatabase:
         ''')
 
         # Table for logging access (authorized only)
-        self.cursor.execute('''
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS access_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 plate_number TEXT,
@@ -38,7 +128,7 @@ class ANPRDatabase:
         ''')
 
         # Table for logging ALL detections (raw feed)
-        self.cursor.execute('''
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS all_detections (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 plate_number TEXT,
@@ -47,123 +137,299 @@ class ANPRDatabase:
                 is_authorized BOOLEAN
             )
         ''')
-        self.conn.commit()
+        self.conn.execute('COMMIT')
+
+    def _load_authorized(self):
+        """Load the authorized table into memory (plate -> owner) so lookups skip SQLite."""
+        rows = self.conn.execute('SELECT plate_number, owner_name FROM authorized_vehicles')
+        self._auth = {plate: owner for plate, owner in rows}
 
     def is_authorized(self, plate_number):
         """
         Check if a vehicle is authorized.
         Returns: (bool, owner_name)
         """
-        # Normalize: remove spaces, uppercase
-        clean_plate = plate_number.replace(' ', '').upper()
-        
-        self.cursor.execute('SELECT owner_name FROM authorized_vehicles WHERE plate_number = ?', (clean_plate,))
-        result = self.cursor.fetchone()
+        # Normalize: remove spaces/hyphens, uppercase
+        clean_plate = normalize_plate(plate_number)
         
-        if result:
-            return True, result[0]
+        if clean_plate in self._auth:
+            return True, self._auth[clean_plate]
         return False, None
 
-    def log_entry(self, plate_number, location="Main Gate", confidence=0.0, image_path=None):
-        """Log a vehicle entry (Authorized)."""
-        clean_plate = plate_number.replace(' ', '').upper()
+    def log_entry(self, plate_number, location="Main Gate", confidence=0.0, image_path=None, owner_name=None):
+        """
+        Log a vehicle entry (Authorized).
+        owner_name: pass it when the caller already looked it up, to skip a second lookup.
+        """
+        clean_plate = normalize_plate(plate_number)
         timestamp = datetime.now()
         
-        print(f"[DB] Logging Authorized Entry: {clean_plate} at {timestamp}")
-        
-        self.cursor.execute('''
-            INSERT INTO access_logs (plate_number, timestamp, location, confidence, image_path)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (clean_plate, timestamp, location, confidence, image_path))
-        self.conn.commit()
+        with self._pending_lock:
+            self._pending_access.append((clean_plate, timestamp, location, confidence, image_path))
+            self._dirty = True
 
         # Log to human-readable JSON
-        self._log_to_json(clean_plate, location, timestamp)
+        self._log_to_json(clean_plate, location, timestamp, owner_name)
 
-    def _log_to_json(self, plate_number, location, timestamp):
-        """Helper to log entry to human-readable JSON file."""
-        json_path = os.path.join(os.path.dirname(self.db_path), 'vehicles.db.json')
-        
-        data = []
-        if os.path.exists(json_path):
-            try:
-                with open(json_path, 'r') as f:
-                    data = json.load(f)
-            except json.JSONDecodeError:
-                data = []
-
-        # Find if vehicle exists
-        vehicle_entry = next((item for item in data if item["numberPlate"] == plate_number), None)
-        
-        # Prepare location object
-        lat = ""
-        long = ""
-        
+    def current_location(self):
+        """
+        Latest (lat, long) from data/gps_state.json, or ("", "") if unknown.
+        The file is only re-parsed when its mtime changes (the location server writes it ~1 Hz).
+        """
         # Read GPS State (Hybrid Integration)
         # Requirement: Read from data/gps_state.json
-        state_path = os.path.join(os.path.dirname(self.db_path), 'gps_state.json')
-        if os.path.exists(state_path):
-             try:
-                 with open(state_path, 'r') as f:
-                     state = json.load(f)
-                     # Check freshness? For now, just use what's there as per simple requirement.
-                     # Verify if it has data
-                     if state.get("lat") and state.get("long"):
-                         lat = state["lat"]
-                         long = state["long"]
-             except Exception as e:
-                 print(f"[DB] Error reading GPS state: {e}")
+        try:
+            mtime = os.stat(self._gps_state_path).st_mtime_ns
+        except FileNotFoundError:
+            return "", ""
+        except OSError as e:
+            print(f"[DB] Error reading GPS state: {e}")
+            return self._gps_cache["lat"], self._gps_cache["long"]
 
-        loc_entry = {
-            "lat": str(lat),
-            "long": str(long),
-            "timestamp": str(timestamp)
-        }
+        if mtime != self._gps_cache["mtime"]:
+            lat = ""
+            long = ""
+            try:
+                with open(self._gps_state_path, 'r') as f:
+                    state = json.load(f)
+                # Check freshness? For now, just use what's there as per simple requirement.
+                # Verify if it has data
+                if state.get("lat") and state.get("long"):
+                    lat = state["lat"]
+                    long = state["long"]
+            except Exception as e:
+                # Possibly caught mid-write; keep the mtime stale so the next call retries
+                print(f"[DB] Error reading GPS state: {e}")
+                return self._gps_cache["lat"], self._gps_cache["long"]
+            self._gps_cache = {"mtime": mtime, "lat": lat, "long": long}
+
+        return self._gps_cache["lat"], self._gps_cache["long"]
+
+    def _read_vehicle_json(self):
+        """
+        Parse vehicles.db.json. Returns (plate -> entry dict, mtime); ({}, None) if the file
+        doesn't exist yet, and (None, None) if it exists but can't be parsed.
+        """
+        try:
+            with open(self.json_path, 'r') as f:
+                data = json.load(f)
+            return {item["numberPlate"]: item for item in data}, os.path.getmtime(self.json_path)
+        except FileNotFoundError:
+            return {}, None
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            # e.g. a hand edit with a stray quote - never mistake that for an empty directory
+            print(f"[DB] Error reading {self.json_path}: {e}")
+            return None, None
+
+    def _load_vehicle_index(self):
+        """Load vehicles.db.json once and replay any JSONL entries not yet compacted into it."""
+        self._vehicles_index, self._json_mtime = self._read_vehicle_json()
+        if self._vehicles_index is None:
+            # Unparsable file: start empty but leave _json_mtime unset, so compact_json()
+            # re-reads it (and refuses to overwrite it) until it's fixed
+            self._vehicles_index = {}
+        self._unsaved_locations = [] # (plate, owner_name, loc_entry) not yet in vehicles.db.json
 
+        # Lines left over from a run that didn't shut down cleanly
+        try:
+            with open(self.jsonl_path, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = _json_loads(line)
+                    except ValueError:
+                        continue # torn final line
+                    self._apply_location(self._vehicles_index, rec["numberPlate"], rec.get("ownerName"), rec["location"])
+                    self._unsaved_locations.append((rec["numberPlate"], rec.get("ownerName"), rec["location"]))
+        except FileNotFoundError:
+            pass
+
+        self._jsonl_file = open(self.jsonl_path, 'ab')
+        if self._unsaved_locations:
+            self.compact_json()
+
+    @staticmethod
+    def _apply_location(index, plate_number, owner_name, loc_entry):
+        """Append a location to a plate's entry in index, creating the entry if needed."""
+        vehicle_entry = index.get(plate_number)
         if vehicle_entry:
             vehicle_entry["locations"].append(loc_entry)
         else:
-            # Fetch owner name
-            is_auth, owner_name = self.is_authorized(plate_number)
-            new_entry = {
+            index[plate_number] = {
                 "ownerName": owner_name if owner_name else "Unknown",
                 "vehicleName": "", # Placeholder as requested
                 "numberPlate": plate_number,
                 "locations": [loc_entry]
             }
-            data.append(new_entry)
 
-        with open(json_path, 'w') as f:
-            json.dump(data, f, indent=2)
+    def _log_to_json(self, plate_number, location, timestamp, owner_name=None):
+        """Helper to log entry to human-readable JSON file (via the JSONL append log)."""
+        # Prepare location object
+        lat, long = self.current_location()
+
+        loc_entry = {
+            "lat": str(lat),
+            "long": str(long),
+            "timestamp": str(timestamp)
+        }
+
+        with self._json_lock:
+            if plate_number in self._vehicles_index:
+                # Owner name is only needed for a new entry
+                owner_name = None
+            elif owner_name is None:
+                # Fetch owner name unless the caller already passed it
+                is_auth, owner_name = self.is_authorized(plate_number)
+
+            self._apply_location(self._vehicles_index, plate_number, owner_name, loc_entry)
+            self._unsaved_locations.append((plate_number, owner_name, loc_entry))
+
+            record = {"numberPlate": plate_number, "ownerName": owner_name, "location": loc_entry}
+            self._jsonl_file.write(_json_line(record))
+            self._jsonl_file.flush()
+
+    def _sync_vehicle_json(self):
+        """
+        If vehicles.db.json was edited by hand since we last read/wrote it (e.g. vehicleName
+        filled in), start from that version and re-apply our unsaved locations on top.
+        Caller holds _json_lock. Returns False if the file on disk can't be parsed.
+        """
+        try:
+            mtime = os.path.getmtime(self.json_path)
+        except OSError:
+            return True
+        if mtime == self._json_mtime:
+            return True
+
+        index, _ = self._read_vehicle_json()
+        if index is None:
+            return False
+        for plate_number, owner_name, loc_entry in self._unsaved_locations:
+            self._apply_location(index, plate_number, owner_name, loc_entry)
+        self._vehicles_index = index
+        self._json_mtime = mtime
+        return True
+
+    def refresh_vehicles(self):
+        """Pick up hand edits to vehicles.db.json (only re-parsed when its mtime changes)."""
+        with self._json_lock:
+            self._sync_vehicle_json()
+
+    def vehicle_record(self, plate_number, default=None):
+        """Return the vehicles.db.json record for a plate, or default."""
+        with self._json_lock:
+            return self._vehicles_index.get(normalize_plate(plate_number), default)
+
+    def compact_json(self):
+        """Rewrite vehicles.db.json from memory and truncate the JSONL append log."""
+        with self._json_lock:
+            if not self._unsaved_locations:
+                return
+
+            if not self._sync_vehicle_json():
+                # Keep the JSONL (it still has every unsaved location) and retry next time
+                print(f"[DB] Not rewriting {self.json_path} until it parses again.")
+                return
 
+            tmp_path = self.json_path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(list(self._vehicles_index.values()), f, indent=2)
+                os.replace(tmp_path, self.json_path)
+            except OSError as e:
+                # e.g. file briefly locked by a reader on Windows; JSONL still has everything
+                print(f"[DB] Error writing {self.json_path}: {e}")
+                return
+
+            self._json_mtime = os.path.getmtime(self.json_path)
+            self._jsonl_file.truncate(0)
+            self._unsaved_locations = []
 
     def log_detection(self, plate_number, confidence=0.0, is_authorized=False):
         """Log ANY detected vehicle."""
-        clean_plate = plate_number.replace(' ', '').upper()
+        clean_plate = normalize_plate(plate_number)
         timestamp = datetime.now()
         
         # print(f"[DB] Logging Detection: {clean_plate}") # Optional verbose log
         
-        self.cursor.execute('''
-            INSERT INTO all_detections (plate_number, timestamp, confidence, is_authorized)
-            VALUES (?, ?, ?, ?)
-        ''', (clean_plate, timestamp, confidence, is_authorized))
-        self.conn.commit()
+        with self._pending_lock:
+            self._pending_detections.append((clean_plate, timestamp, confidence, is_authorized))
+            self._dirty = True
 
     def add_authorized_vehicle(self, plate_number, owner_name):
         """Add a new authorised vehicle to the database."""
-        clean_plate = plate_number.replace(' ', '').upper()
-        try:
-            self.cursor.execute('INSERT INTO authorized_vehicles (plate_number, owner_name) VALUES (?, ?)', 
-                                (clean_plate, owner_name))
-            self.conn.commit()
+        clean_plate = normalize_plate(plate_number)
+        with self._write_lock:
+            added = self.conn.execute(self._INSERT_AUTHORIZED_SQL, (clean_plate, owner_name)).rowcount == 1
+        if added:
+            self._auth[clean_plate] = owner_name
             print(f"[DB] Added vehicle {clean_plate} for {owner_name}")
-            return True
-        except sqlite3.IntegrityError:
+        else:
             print(f"[DB] Vehicle {clean_plate} already exists.")
-            return False
+        return added
+
+    def add_authorized_vehicles(self, vehicles):
+        """
+        Bulk-load (plate_number, owner_name) pairs in a single transaction.
+        Plates already present are left untouched. Returns the number of vehicles added.
+        """
+        rows = [(normalize_plate(plate), owner) for plate, owner in vehicles]
+        if not rows:
+            return 0
+        with self._write_lock:
+            try:
+                self.conn.execute('BEGIN')
+                added = self.conn.executemany(self._INSERT_AUTHORIZED_SQL, rows).rowcount
+                self.conn.execute('COMMIT')
+            except sqlite3.Error:
+                self.conn.execute('ROLLBACK')
+                raise
+        for plate, owner in rows:
+            # DO NOTHING keeps the first owner for a plate; mirror that in the cache
+            self._auth.setdefault(plate, owner)
+        print(f"[DB] Added {added} of {len(rows)} vehicles.")
+        return added
+
+    def _flush_loop(self):
+        # At most one commit per flush_interval, and none at all while idle
+        last_compact = time.monotonic()
+        while not self._stop_flush.wait(self.flush_interval):
+            if self._dirty:
+                self.flush()
+            if time.monotonic() - last_compact >= self.compact_interval:
+                self.compact_json()
+                last_compact = time.monotonic()
+
+    def flush(self):
+        """Write all buffered access_logs / all_detections rows in a single transaction."""
+        with self._pending_lock:
+            access, self._pending_access = self._pending_access, []
+            detections, self._pending_detections = self._pending_detections, []
+            self._dirty = False
+        if not access and not detections:
+            return
+
+        with self._write_lock:
+            try:
+                self.conn.execute('BEGIN')
+                if access:
+                    self.conn.executemany(self._INSERT_ACCESS_SQL, access)
+                if detections:
+                    self.conn.executemany(self._INSERT_DETECTION_SQL, detections)
+                self.conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                print(f"[DB] Error writing {len(access)} access log(s) / {len(detections)} detection(s): {e}")
+                if self.conn.in_transaction:
+                    self.conn.execute('ROLLBACK')
 
     def close(self):
+        self._stop_flush.set()
+        self._flusher.join()
+        self.flush()
+        self.compact_json()
+        self._jsonl_file.close()
         self.conn.close()
 
 if __name__ == "__main__":
@@ -2,21 +2,61 @@ import cv2
 from ultralytics import YOLO
 import numpy as np
 import os
+import importlib.util
+import torch
+import torch.nn.functional as F
+# Needs ultralytics>=8.1 (ultralytics.utils, predictor.model = AutoBackend); see requirements.txt
+try:
+    from ultralytics.utils.nms import non_max_suppression
+except ImportError:
+    # Releases before the nms module keep NMS in ops
+    from ultralytics.utils.ops import non_max_suppression
 
 class VehicleDetector:
-    def __init__(self, model_path='yolov8n.pt'):
+    def __init__(self, model_path='yolov8n.pt', imgsz=640, use_tensorrt=True, use_onnx=True, max_batch=8, int8_data=None,
+                 plate_cascade_path=None):
         """
         Initialize YOLOv8 for vehicle detection.
+        On a CUDA machine the .pt weights are exported once to a TensorRT engine (FP16, or INT8
+        when int8_data points at a calibration dataset yaml) and the engine is loaded instead.
+        On CPU they are exported once to ONNX (ONNX Runtime's fused kernels beat torch eager).
+        plate_cascade_path: optional plate cascade xml (e.g. an LBP one); defaults to
+        ./lbpcascade_license_plate.xml if present, else OpenCV's Haar plate cascade.
         """
+        self.imgsz = imgsz
+        cuda = torch.cuda.is_available()
+        if model_path.endswith('.pt'):
+            if cuda and use_tensorrt:
+                model_path = self._ensure_engine(model_path, max_batch, int8_data)
+            elif not cuda and use_onnx:
+                model_path = self._ensure_onnx(model_path)
+
         print(f"[Detector] Loading YOLOv8 model: {model_path}...")
-        self.model = YOLO(model_path)
+        self.model = YOLO(model_path, task='detect')
+
+        # Plain PyTorch weights on GPU (no engine, or export failed) run in FP16;
+        # exported engines carry their own precision
+        self.half = cuda and model_path.endswith('.pt')
+        self.predict_device = 0 if cuda else 'cpu'
+
+        # GPU pre-processing: frames are uploaded as raw BGR uint8 and letterboxed on the device,
+        # instead of Ultralytics doing resize/BGR->RGB/normalize as separate CPU passes.
+        self.device = torch.device('cuda') if torch.cuda.is_available() else None
+        self._pinned = None     # (B,H,W,3) uint8 page-locked staging buffer
+        self._gpu_input = None  # (B,3,imgsz,imgsz) float model input, reused every call
         
         # Classes for vehicles in COCO dataset: car(2), motorcycle(3), bus(5), truck(7)
         self.vehicle_classes = [2, 3, 5, 7]
+        # Boolean lookup by class id (80 for COCO): membership is a single gather per frame
+        self._cls_mask = np.zeros(max(80, len(self.model.names)), dtype=bool)
+        self._cls_mask[self.vehicle_classes] = True
         
-        # Load Haar Cascade for Plate Detection as a fallback/refinement
+        # Load a cascade for Plate Detection as a fallback/refinement
         # Note: In a production environment, training a YOLO model specifically for plates is better.
-        # We use Haar here to avoid forcing the user to download custom weights manually.
+        # We use a cascade here to avoid forcing the user to download custom weights manually.
+        # An LBP cascade (integer comparisons, ~2-3x faster than Haar) is preferred when one is supplied;
+        # OpenCV only ships the Haar plate cascade, so that remains the default.
+        lbp_path = plate_cascade_path or 'lbpcascade_license_plate.xml'
         try:
             haar_path = os.path.join(cv2.data.haarcascades, 'haarcascade_russian_plate_number.xml')
         except AttributeError:
@@ -29,38 +69,212 @@ class VehicleDetector:
             haar_path = 'haarcascade_russian_plate_number.xml'
         
         self.plate_cascade = None
-        if os.path.exists(haar_path):
-             self.plate_cascade = cv2.CascadeClassifier(haar_path)
-        else:
-            print("[Warning] HAAR Cascade for plates not found. Will return full vehicle crop (lower accuracy).")
+        for cascade_path in (lbp_path, haar_path):
+            if os.path.exists(cascade_path):
+                cascade = cv2.CascadeClassifier(cascade_path)
+                if not cascade.empty():
+                    print(f"[Detector] Plate cascade: {os.path.basename(cascade_path)}")
+                    self.plate_cascade = cascade
+                    break
+        if self.plate_cascade is None:
+            print("[Warning] Plate cascade not found. Will return full vehicle crop (lower accuracy).")
+
+    def _ensure_engine(self, model_path, max_batch, int8_data):
+        """
+        Export model_path to a TensorRT .engine next to it if one doesn't exist yet.
+        Returns the path to load (falls back to the .pt weights if export fails).
+        """
+        precision = "INT8" if int8_data else "FP16"
+        export_args = dict(format='engine', imgsz=self.imgsz, half=True, dynamic=True, batch=max_batch)
+        if int8_data:
+            # Calibration frames (e.g. ~200 gate-scene images under data/calib/) described by a dataset yaml
+            export_args.update(int8=True, data=int8_data)
+        return self._export_once(model_path, '.engine', f"TensorRT ({precision})", ['tensorrt'], export_args)
+
+    def _ensure_onnx(self, model_path):
+        """
+        Export model_path to ONNX next to it if that hasn't been done yet (CPU deployments).
+        Returns the path to load (falls back to the .pt weights if export fails).
+        """
+        # FP16 is GPU-only in ONNX Runtime, so the CPU export stays FP32
+        export_args = dict(format='onnx', imgsz=self.imgsz, dynamic=True)
+        return self._export_once(model_path, '.onnx', "ONNX", ['onnx', 'onnxruntime'], export_args)
+
+    def _export_once(self, model_path, ext, label, modules, export_args):
+        """
+        Export model_path to <stem><ext> unless it already exists. The export only runs when its
+        packages are installed (so Ultralytics never pip-installs them at startup), and a failed
+        export leaves a <stem><ext>.failed marker so it isn't retried on every launch.
+        Returns the path to load, or model_path to fall back to the PyTorch weights.
+        """
+        out_path = os.path.splitext(model_path)[0] + ext
+        if os.path.exists(out_path):
+            return out_path
+
+        missing = [m for m in modules if importlib.util.find_spec(m) is None]
+        if missing:
+            print(f"[Detector] {label} export skipped: pip install {' '.join(missing)} to enable it. Using PyTorch weights.")
+            return model_path
+
+        failed_marker = out_path + '.failed'
+        if os.path.exists(failed_marker):
+            print(f"[Detector] {label} export failed previously (delete {failed_marker} to retry). Using PyTorch weights.")
+            return model_path
+
+        print(f"[Detector] No {label} model found. Exporting {model_path} (one-time, may take minutes)...")
+        try:
+            exported = YOLO(model_path).export(**export_args)
+            return exported or out_path
+        except Exception as e:
+            print(f"[Warning] {label} export failed ({e}). Using PyTorch weights.")
+            try:
+                with open(failed_marker, 'w') as f:
+                    f.write(f"{e}\n")
+            except OSError:
+                pass
+            return model_path
 
     def detect_vehicles(self, frame):
         """
         Detect vehicles in the frame.
-        Returns list of (box, confidence, class_id)
+        Returns (boxes, confidences, class_ids) arrays:
+        boxes (N,4) int32 [x1, y1, x2, y2], confidences (N,) float32, class_ids (N,) int32
         """
-        results = self.model(frame, verbose=False)[0]
-        detections = []
-        
-        for box in results.boxes:
-            cls_id = int(box.cls[0])
-            conf = float(box.conf[0])
-            
-            if cls_id in self.vehicle_classes and conf > 0.5:
-                # box.xyxy provides [x1, y1, x2, y2]
-                detections.append((box.xyxy[0].cpu().numpy(), conf, cls_id))
-        
-        return detections
+        return self.detect_vehicles_batch([self.downscale(frame)], [frame.shape])[0]
+
+    def downscale(self, frame):
+        """
+        Shrink a frame so its long side is imgsz (the model's input size), using INTER_AREA.
+        Much less data to letterbox/upload per frame; frames already that small are returned as is.
+        """
+        h, w = frame.shape[:2]
+        scale = self.imgsz / float(max(h, w))
+        if scale >= 1:
+            return frame
+        return cv2.resize(frame, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    def detect_vehicles_batch(self, frames, orig_shapes=None):
+        """
+        Detect vehicles in several frames with a single forward pass.
+        orig_shapes: if frames were downscaled, the original frame shapes to map boxes back onto.
+        Returns one (boxes, confidences, class_ids) tuple per input frame (see detect_vehicles).
+        """
+        if not frames:
+            return []
+
+        if self.device is not None:
+            batch, letterbox = self._preprocess_gpu(frames)
+            # Run the backend + NMS directly rather than self.model(batch): the predictor would copy
+            # the whole (B,3,imgsz,imgsz) input back to the host to build each Result's orig_img.
+            preds = self._backend()(batch)
+            dets = non_max_suppression(preds, conf_thres=0.25, iou_thres=0.7, max_det=300)
+        else:
+            # Ultralytics letterboxes and stacks a list of images into one (B,3,H,W) batch
+            results = self.model(list(frames), verbose=False, half=self.half, device=self.predict_device)
+            dets = [result.boxes.data for result in results]
+            letterbox = None
+
+        batch_detections = []
+
+        # One device->host transfer for the whole batch: concatenate every frame's
+        # (N,6) [x1, y1, x2, y2, conf, cls] rows, copy once, then split per frame.
+        counts = [len(det) for det in dets]
+        if sum(counts):
+            data = torch.cat(dets).float().cpu().numpy()
+        else:
+            data = np.empty((0, 6), dtype=np.float32)
+        per_frame = np.split(data, np.cumsum(counts)[:-1])
+
+        for i, rows in enumerate(per_frame):
+            xyxy = rows[:, :4]
+            confs = rows[:, 4].astype(np.float32)
+            cls_ids = rows[:, 5].astype(np.int32)
+
+            keep = self._cls_mask[cls_ids] & (confs > 0.5)
+            xyxy = xyxy[keep]
+            if letterbox is not None:
+                xyxy = self._unletterbox(xyxy, letterbox, frames[i].shape)
+            if orig_shapes is not None:
+                h, w = frames[i].shape[:2]
+                orig_h, orig_w = orig_shapes[i][:2]
+                if (h, w) != (orig_h, orig_w):
+                    xyxy = xyxy * np.array([orig_w / w, orig_h / h, orig_w / w, orig_h / h], dtype=np.float32)
+
+            batch_detections.append((xyxy.astype(np.int32), confs[keep], cls_ids[keep]))
+
+        return batch_detections
+
+    def _backend(self):
+        """
+        Ultralytics' AutoBackend (PyTorch / TensorRT / ONNX, with device and FP16 already set up).
+        The predictor is created lazily, so the first call runs one blank frame through it.
+        """
+        if self.model.predictor is None:
+            blank = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+            self.model(blank, verbose=False, half=self.half, device=self.predict_device)
+        return self.model.predictor.model
+
+    @staticmethod
+    def no_detections():
+        """Empty (boxes, confidences, class_ids) result, same layout as detect_vehicles."""
+        return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32)
+
+    def _preprocess_gpu(self, frames):
+        """
+        Letterbox, BGR->RGB, /255 and HWC->CHW on the GPU.
+        Returns (input_tensor, (scale, pad_x, pad_y)). Frames must share one shape (same camera).
+        """
+        n = len(frames)
+        h, w = frames[0].shape[:2]
+
+        if self._pinned is None or self._pinned.shape[0] < n or self._pinned.shape[1:3] != (h, w):
+            self._pinned = torch.empty((n, h, w, 3), dtype=torch.uint8).pin_memory()
+        if self._gpu_input is None or self._gpu_input.shape[0] < n:
+            self._gpu_input = torch.empty((n, 3, self.imgsz, self.imgsz), dtype=torch.float32, device=self.device)
+
+        for i, frame in enumerate(frames):
+            self._pinned[i].numpy()[...] = frame
+        raw = self._pinned[:n].to(self.device, non_blocking=True)
+
+        # Same geometry as Ultralytics' letterbox: keep aspect ratio, centre, pad with grey 114
+        scale = min(self.imgsz / h, self.imgsz / w)
+        new_h, new_w = int(round(h * scale)), int(round(w * scale))
+        pad_y = (self.imgsz - new_h) // 2
+        pad_x = (self.imgsz - new_w) // 2
+
+        out = self._gpu_input[:n]
+        out.fill_(114 / 255.0)
+        dst = out[:, :, pad_y:pad_y + new_h, pad_x:pad_x + new_w]
+
+        # uint8 BGR HWC -> float RGB CHW in [0, 1]
+        x = raw.permute(0, 3, 1, 2).flip(1)
+        if (new_h, new_w) == (h, w):
+            # Frames already downscaled to imgsz: no resample, convert straight into the model input
+            dst.copy_(x).div_(255.0)
+        else:
+            x = x.float().div_(255.0)
+            dst.copy_(F.interpolate(x, size=(new_h, new_w), mode='bilinear', align_corners=False))
+        return out, (scale, pad_x, pad_y)
+
+    def _unletterbox(self, xyxy, letterbox, frame_shape):
+        """Map (N,4) boxes from model-input coordinates back onto the original frame."""
+        scale, pad_x, pad_y = letterbox
+        h, w = frame_shape[:2]
+        boxes = (xyxy - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)) / scale
+        return np.clip(boxes, 0, np.array([w, h, w, h], dtype=np.float32))
 
-    def detect_plate(self, vehicle_image):
+    def detect_plate(self, vehicle_image, vehicle_gray=None):
         """
         Refine detection to find the plate within a vehicle image.
+        vehicle_gray: the same crop already in grayscale (e.g. sliced from a frame converted once),
+        to skip a per-vehicle color conversion. May be a cv2.UMat, in which case the cascade
+        runs through OpenCL.
         Returns: (plate_image, plate_box_relative_to_vehicle)
         """
         if self.plate_cascade is None:
             return vehicle_image, [0, 0, vehicle_image.shape[1], vehicle_image.shape[0]]
 
-        gray = cv2.cvtColor(vehicle_image, cv2.COLOR_BGR2GRAY)
+        gray = vehicle_gray if vehicle_gray is not None else cv2.cvtColor(vehicle_image, cv2.COLOR_BGR2GRAY)
         # Tuned parameters: scaleFactor=1.05 (slower but more scales), minNeighbors=3 (less strict)
         plates = self.plate_cascade.detectMultiScale(gray, scaleFactor=1.05, minNeighbors=3, minSize=(20, 20))
         
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+
+# (text, font_scale, thickness) -> (alpha, (dx, dy)) pre-rendered glyph coverage
+_text_cache = {}
+MAX_CACHED_TEXTS = 64
+
+def _render_text_mask(text, font_scale, thickness):
+    """Rasterise text once into a coverage mask plus the offset from the putText origin to its top-left."""
+    (tw, th), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    pad = thickness
+    mask = np.zeros((th + baseline + 2 * pad, tw + 2 * pad), dtype=np.uint8)
+    cv2.putText(mask, text, (pad, th + pad), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, thickness)
+    # Keep coverage rather than a bool mask: some OpenCV builds anti-alias glyphs
+    alpha = mask[:, :, None].astype(np.uint16)
+    return alpha, (-pad, -(th + pad))
+
+def draw_cached_text(img, text, org, font_scale, color, thickness=1):
+    """
+    Drop-in for cv2.putText(img, text, org, FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+    for labels that repeat every frame ("Vehicle", "No Plate", status strings).
+    Glyphs are rasterised once; later calls only blit the cached mask.
+    """
+    key = (text, font_scale, thickness)
+    entry = _text_cache.get(key)
+    if entry is None:
+        if len(_text_cache) >= MAX_CACHED_TEXTS:
+            # Not a repeating label - don't let one-off strings grow the cache
+            cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+            return
+        entry = _render_text_mask(text, font_scale, thickness)
+        _text_cache[key] = entry
+
+    alpha, (dx, dy) = entry
+    x, y = org[0] + dx, org[1] + dy
+    h, w = alpha.shape[:2]
+
+    # Clip against the image borders
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, img.shape[1]), min(y + h, img.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    roi = img[y0:y1, x0:x1]
+    a = alpha[y0 - y:y1 - y, x0 - x:x1 - x]
+    blended = (roi * (255 - a) + np.asarray(color, dtype=np.uint16) * a + 127) // 255
+    roi[...] = blended.astype(np.uint8)
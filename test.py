@@ -1,42 +1,64 @@
 import cv2
 import argparse
+import functools
 from src.detector import VehicleDetector
 from src.ocr import OCRSystem
 
+@functools.lru_cache(maxsize=1)
+def get_detector():
+    """Shared VehicleDetector; YOLO weights are loaded once per process."""
+    return VehicleDetector()
+
+@functools.lru_cache(maxsize=1)
+def get_ocr():
+    """Shared OCRSystem; the EasyOCR models are loaded once per process."""
+    return OCRSystem()
+
+def preload():
+    """Load both models up front so every test_image() call pays only inference."""
+    get_detector()
+    get_ocr()
+
 def test_image(image_path):
     print(f"Testing on image: {image_path}")
     
-    detector = VehicleDetector()
-    ocr = OCRSystem()
+    detector = get_detector()
+    ocr = get_ocr()
     
     frame = cv2.imread(image_path)
     if frame is None:
         print("Error: Could not read image.")
         return
 
-    vehicles = detector.detect_vehicles(frame)
-    print(f"Found {len(vehicles)} vehicles.")
+    boxes, confs, classes = detector.detect_vehicles(frame)
+    print(f"Found {len(boxes)} vehicles.")
     
-    for i, (v_box, v_conf, v_cls) in enumerate(vehicles):
-        x1, y1, x2, y2 = map(int, v_box)
+    plates = [] # (vehicle number, plate_img)
+    for i, (x1, y1, x2, y2) in enumerate(boxes.tolist()):
         vehicle_img = frame[y1:y2, x1:x2]
         
         plate_img, p_box = detector.detect_plate(vehicle_img)
         
         if plate_img is not None:
-            text, conf = ocr.extract_text(plate_img)
-            print(f"Vehicle {i+1}: Plate Text: '{text}' (Conf: {conf:.2f})")
-            
-            # Show result
-            cv2.imshow(f"Vehicle {i+1} Plate", plate_img)
+            plates.append((i + 1, plate_img))
         else:
             print(f"Vehicle {i+1}: No plate detected.")
+
+    # One batched OCR pass over every plate found
+    readings = ocr.extract_text_batch([plate_img for (_, plate_img) in plates])
+    for (n, plate_img), (text, conf) in zip(plates, readings):
+        print(f"Vehicle {n}: Plate Text: '{text}' (Conf: {conf:.2f})")
+        
+        # Show result
+        cv2.imshow(f"Vehicle {n} Plate", plate_img)
             
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("image", help="Path to image file")
+    parser.add_argument("images", nargs="+", help="Path to image file(s)")
     args = parser.parse_args()
-    test_image(args.image)
+    preload()
+    for image_path in args.images:
+        test_image(image_path)